@@ -0,0 +1,52 @@
+import logging
+from collections import Counter
+
+from config import SHED_RENDER_QUEUE, SHED_SEND_QUEUE, SHED_CYCLE_SECONDS
+
+# Degradation levels, each one includes the ones before it
+LEVEL_NORMAL = 0
+LEVEL_CACHED_MEMES = 1  # no new renders, only memes already in the cache
+LEVEL_TEXT_ONLY = 2     # captions only, no videos at all
+LEVEL_COMBINED = 3      # one combined text message per chat
+
+LEVEL_NAMES = {
+    LEVEL_NORMAL: "normal",
+    LEVEL_CACHED_MEMES: "cached_memes_only",
+    LEVEL_TEXT_ONLY: "text_only",
+    LEVEL_COMBINED: "combined",
+}
+
+# While a batch is delivered, the level is re-checked after this many sends
+# and at least this often while waiting for renders
+RECHECK_EVERY_SENDS = 20
+RECHECK_SECONDS = 5
+
+# Shedding decisions and their effects since startup (for /statistik)
+stats = Counter()
+
+def _level_for(value: float, thresholds) -> int:
+    """Number of thresholds (ascending, one per level) that value exceeds."""
+    return sum(1 for limit in thresholds if value > limit)
+
+def choose_level(render_queue: int, send_queue: int, cycle_seconds: float, where: str,
+                 current: int = LEVEL_NORMAL) -> int:
+    """Picks the delivery level for a batch from the current backlog. A batch
+    never steps back below its ``current`` level; only a rise is logged."""
+    level = max(
+        current,
+        _level_for(render_queue, SHED_RENDER_QUEUE),
+        _level_for(send_queue, SHED_SEND_QUEUE),
+        _level_for(cycle_seconds, SHED_CYCLE_SECONDS),
+    )
+    if level != current:
+        stats[LEVEL_NAMES[level]] += 1
+        logging.warning(
+            f"Load shedding for {where}: {LEVEL_NAMES[level]} "
+            f"(render queue {render_queue}, send queue {send_queue}, cycle {cycle_seconds:.0f}s)"
+        )
+    return level
+
+def count(event: str, n: int = 1):
+    """Counts an individual shedding effect (e.g. memes sent as text)."""
+    if n:
+        stats[event] += n
@@ -1,18 +1,27 @@
+import time
+
+_STARTUP_T0 = time.perf_counter()
+
 import logging
 import asyncio
+import functools
 import os
-import re
-import requests
-from bs4 import BeautifulSoup
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, CallbackQueryHandler, MessageHandler, filters
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+from telegram.ext import ApplicationBuilder, BaseUpdateProcessor, ContextTypes, CommandHandler, CallbackQueryHandler, MessageHandler, filters
 
 # Import modules
-from config import USER_VPLAN, PASSWORD_VPLAN, BASE_DIR
+from config import SOURCES, DEFAULT_SOURCE, STARTUP_BUDGET, CONCURRENT_UPDATES, RENDER_TIMEOUT, RENDER_WORKERS, ADMIN_CHAT_IDS, PRUNE_AFTER_FAILURES
 import storage
 from state_manager import load_state, save_state, calculate_hash
-from meme_handler import create_meme, get_next_template_id
+from meme_handler import create_meme, get_next_template_id, get_cached_meme, cache_meme
+import meme_handler
+import backpressure
+from row_classifier import classify_row
 
 # Load environment variables
 load_dotenv()
@@ -23,8 +32,6 @@ logging.basicConfig(
     level=logging.INFO
 )
 
-Wochentage = ["Montag", "Dienstag", "Mittwoch", "Donnerstag", "Freitag"]
-
 def matches_class(user_class: str, cell_value: str) -> bool:
     """Checks if a user's class subscription matches the cell value in the substitution plan."""
     user_class = user_class.strip().lower()
@@ -56,13 +63,68 @@ def matches_class(user_class: str, cell_value: str) -> bool:
             
     return False
 
-def scrape_available_courses() -> list:
-    """Fallback to dynamically scrape available courses from dksdd.de."""
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates of different chats concurrently, but each chat's
+    updates one after another in arrival order, so storage read-modify-write
+    and context.user_data["waiting_for_course"] stay consistent per chat."""
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._chat_locks = {}  # chat_id -> [asyncio.Lock, number of users]
+
+    async def do_process_update(self, update, coroutine):
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            await coroutine
+            return
+
+        # Runs inside one of the shared slots, so an update waiting here for
+        # a slow handler of the same chat holds a slot until its turn.
+        # asyncio.Lock wakes waiters in FIFO order, which keeps arrival order.
+        lock_ref = self._chat_locks.setdefault(chat.id, [asyncio.Lock(), 0])
+        lock_ref[1] += 1
+        try:
+            async with lock_ref[0]:
+                await coroutine
+        finally:
+            lock_ref[1] -= 1
+            if not lock_ref[1]:
+                del self._chat_locks[chat.id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+def _warm_up_imports():
+    """Imports the heavy scraping and rendering stacks off the startup path."""
+    t0 = time.perf_counter()
+    try:
+        import requests  # noqa: F401
+        from bs4 import BeautifulSoup  # noqa: F401
+    except Exception as e:
+        logging.error(f"Error preloading scraping modules: {e}")
+    meme_handler.warm_up()
+    logging.info(f"Heavy modules preloaded in {time.perf_counter() - t0:.2f}s")
+
+def get_source(name: str) -> dict:
+    """Returns the configured source by name, or the default source if it no longer exists."""
+    for source in SOURCES:
+        if source["name"] == name:
+            return source
+    return next(s for s in SOURCES if s["name"] == DEFAULT_SOURCE)
+
+def scrape_available_courses(source: dict) -> list:
+    """Fallback to dynamically scrape available courses from a plan source."""
+    import requests
+    from bs4 import BeautifulSoup
+
     courses = set()
-    for day in Wochentage:
-        url = f"https://dksdd.de/vtp/{day}.html"
+    for day in source["days"]:
+        url = source["url"].format(day=day)
         try:
-            r = requests.get(url, auth=(USER_VPLAN, PASSWORD_VPLAN))
+            r = requests.get(url, auth=(source["user"], source["password"]), timeout=source["timeout"])
             if r.status_code == 200:
                 soup = BeautifulSoup(r.content, 'html.parser')
                 for tr in soup.find_all('tr'):
@@ -74,13 +136,14 @@ def scrape_available_courses() -> list:
                             if len(parts) > 1 and parts[1]:
                                 courses.add(parts[1])
         except Exception as e:
-            logging.error(f"Error scraping courses for {day}: {e}")
+            logging.error(f"Error scraping courses for {day} ({source['name']}): {e}")
     return sorted(list(courses))
 
-def get_available_courses() -> list:
-    """Returns the list of available courses from faecher.txt, or falls back to cached state/scraping."""
-    faecher_file = BASE_DIR / "faecher.txt"
-    if faecher_file.exists():
+def get_available_courses(source_name: str = DEFAULT_SOURCE) -> list:
+    """Returns the courses of a source from its course file (faecher.txt), or falls back to cached state/scraping."""
+    source = get_source(source_name)
+    faecher_file = source["courses_file"]
+    if faecher_file and faecher_file.exists():
         try:
             courses = []
             with open(faecher_file, "r", encoding="utf-8") as f:
@@ -93,18 +156,22 @@ def get_available_courses() -> list:
                 seen = set()
                 return [x for x in courses if not (x in seen or seen.add(x))]
         except Exception as e:
-            logging.error(f"Error reading faecher.txt: {e}")
+            logging.error(f"Error reading {faecher_file.name}: {e}")
 
     state = load_state()
-    courses = state.get("discovered_courses", [])
+    courses = state.get(state_key(source, "discovered_courses"), [])
     if not courses:
-        courses = scrape_available_courses()
+        courses = scrape_available_courses(source)
     return courses
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Sends a welcome message and prompts for stufe (level)."""
     chat_id = update.effective_chat.id
     user = update.effective_user.first_name
+
+    # A chat that was pruned as unreachable receives notifications again
+    if storage.reactivate_chat(chat_id):
+        logging.info(f"Chat {chat_id} reactivated via /start")
     
     await context.bot.send_message(
         chat_id=chat_id,
@@ -144,6 +211,35 @@ async def stufe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=reply_markup
     )
 
+async def source_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Shows or changes the plan source (school/feed) of the user."""
+    chat_id = update.effective_chat.id
+    names = [source["name"] for source in SOURCES]
+
+    if not context.args:
+        current = get_source(storage.get_student_source(chat_id, DEFAULT_SOURCE))["name"]
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text=f"Deine Quelle: {current}\n"
+                 f"Verfügbar: {', '.join(names)}\n"
+                 "Ändern mit /quelle <name> (setzt deine Klassen zurück)."
+        )
+        return
+
+    name = context.args[0]
+    if name not in names:
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text=f"Unbekannte Quelle: {name}. Verfügbar: {', '.join(names)}"
+        )
+        return
+
+    storage.set_student_source(chat_id, name)
+    await context.bot.send_message(
+        chat_id=chat_id,
+        text=f"Quelle geändert: {name}. Bitte richte deine Klassen mit /klassen neu ein."
+    )
+
 async def add(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Adds a class."""
     if not context.args:
@@ -193,7 +289,8 @@ async def remove(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def classes(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Lists the user's classes."""
     chat_id = update.effective_chat.id
-    stufe = storage.get_student_stufe(chat_id)
+    entry = storage.get_student_entry(chat_id)
+    stufe = entry.get("stufe")
     
     if not stufe:
         keyboard = [
@@ -210,7 +307,7 @@ async def classes(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
         
-    user_classes = storage.get_student_classes(chat_id)
+    user_classes = entry["classes"]
     if stufe == "Mittelstufe":
         class_text = user_classes[0] if user_classes else "keine Klasse ausgewählt"
         text = f"Deine aktuelle Klasse: {class_text}"
@@ -289,10 +386,11 @@ async def show_ober_jg_selection(query):
         reply_markup=reply_markup
     )
 
-async def show_ober_courses(query, jg):
-    chat_id = query.message.chat_id
-    user_classes = storage.get_student_classes(chat_id)
-    available_courses = get_available_courses()
+async def show_ober_courses(query, jg, entry=None):
+    if entry is None:
+        entry = storage.get_student_entry(query.message.chat_id)
+    user_classes = entry["classes"]
+    available_courses = get_available_courses(storage.get_entry_source(entry, DEFAULT_SOURCE))
     
     jg_courses = [c for c in available_courses if c.startswith(jg)]
     user_jg_courses = [c for c in user_classes if c.startswith(jg)]
@@ -356,8 +454,9 @@ async def button_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
     elif data.startswith("set_class:"):
         class_name = data.split(":")[1]
-        storage.set_student_stufe(chat_id, "Mittelstufe", clear_classes=True)
-        storage.add_class(chat_id, class_name)
+        with storage.session(chat_id) as entry:
+            entry["stufe"] = "Mittelstufe"
+            entry["classes"] = [class_name]
         
         await query.edit_message_text(
             text=f"Klasse {class_name} wurde erfolgreich eingerichtet! Du erhältst ab jetzt Benachrichtigungen für diese Klasse."
@@ -375,13 +474,14 @@ async def button_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
         course = parts[1]
         jg = parts[2]
         
-        user_classes = storage.get_student_classes(chat_id)
-        if course in user_classes:
-            storage.remove_class(chat_id, course)
-        else:
-            storage.add_class(chat_id, course)
+        with storage.session(chat_id) as entry:
+            if course in entry["classes"]:
+                entry["classes"].remove(course)
+            else:
+                entry["classes"].append(course)
+            entry = dict(entry, classes=list(entry["classes"]))
             
-        await show_ober_courses(query, jg)
+        await show_ober_courses(query, jg, entry)
         
     elif data == "enter_course_manual":
         context.user_data["waiting_for_course"] = True
@@ -411,7 +511,11 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("Ungültiger Kursname. Bitte erneut versuchen:")
             return
             
-        storage.add_class(chat_id, course_name)
+        with storage.session(chat_id) as entry:
+            if course_name not in entry["classes"]:
+                entry["classes"].append(course_name)
+            user_classes = list(entry["classes"])
+            source_name = storage.get_entry_source(entry, DEFAULT_SOURCE)
         context.user_data["waiting_for_course"] = False
         
         jg = "12" if course_name.startswith("12") else "11"
@@ -419,8 +523,7 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(f"Kurs '{course_name}' hinzugefügt!")
         
         # Send fresh menu
-        user_classes = storage.get_student_classes(chat_id)
-        available_courses = get_available_courses()
+        available_courses = get_available_courses(source_name)
         jg_courses = [c for c in available_courses if c.startswith(jg)]
         user_jg_courses = [c for c in user_classes if c.startswith(jg)]
         
@@ -466,214 +569,550 @@ async def reset_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
         text=f"Daten zurückgesetzt (Version {new_version}). Du erhältst alle aktuellen Benachrichtigungen beim nächsten Check erneut."
     )
 
-async def check_updates(context: ContextTypes.DEFAULT_TYPE):
-    """Periodic job to check for updates on the school website."""
-    logging.info("Checking for updates...")
-    state = load_state()
+_render_executor = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix="render")
+# Renders still running (possibly past their timeout), keyed by meme text
+_pending_renders = {}
+
+def _finish_render(meme_text: str, future):
+    _pending_renders.pop(meme_text, None)
+    if not future.cancelled() and future.exception() is None and future.result() is not None:
+        cache_meme(meme_text, future.result())
+
+async def render_meme(meme_text: str, cached_since: float = None):
+    """Renders a meme on the render pool and returns (meme_text, video bytes or None).
+
+    Memes cached since ``cached_since`` (the cycle start; None accepts any age)
+    are reused and a render already running for the same text is joined. A
+    render exceeding RENDER_TIMEOUT yields None so the caption goes out as
+    text; the thread cannot be stopped, so its result is cached when it
+    finishes and serves the rest of the cycle.
+    """
+    meme_video = get_cached_meme(meme_text, since=cached_since)
+    if meme_video is not None:
+        return meme_text, meme_video
+
+    future = _pending_renders.get(meme_text)
+    if future is None:
+        future = asyncio.get_running_loop().run_in_executor(
+            _render_executor, create_meme, get_next_template_id(), meme_text
+        )
+        future.add_done_callback(functools.partial(_finish_render, meme_text))
+        _pending_renders[meme_text] = future
+
+    try:
+        # shield: a timeout or a cancelled cycle must not drop the running render
+        meme_video = await asyncio.wait_for(asyncio.shield(future), RENDER_TIMEOUT)
+    except asyncio.TimeoutError:
+        logging.warning(f"Render timed out after {RENDER_TIMEOUT:.0f}s: {meme_text}")
+        backpressure.count("render_timeouts")
+        return meme_text, None
+    except Exception as e:
+        logging.error(f"Render failed: {e}")
+        return meme_text, None
+    return meme_text, meme_video
+
+def combine_captions(deliveries: list, limit: int = 4096) -> list:
+    """Joins the captions of deliveries into as few messages as Telegram's
+    length limit allows. Returns (text, deliveries in that message) pairs."""
+    messages = []
+    for delivery in deliveries:
+        caption = delivery[3]
+        if messages and len(messages[-1][0]) + 2 + len(caption) <= limit:
+            text, included = messages[-1]
+            messages[-1] = (text + "\n\n" + caption, included + [delivery])
+        else:
+            messages.append((caption, [delivery]))
+    return messages
+
+async def send_meme(bot, chat_id: int, meme_video, caption_text: str):
+    """Sends a meme (MP4 bytes or a Telegram file_id), falling back to the plain
+    caption. Returns the sent message."""
+    if meme_video:
+        try:
+            return await bot.send_video(
+                chat_id=chat_id,
+                video=meme_video,
+                filename="meme.mp4",
+                caption=caption_text
+            )
+        except (Forbidden, RetryAfter):
+            raise
+        except Exception as e:
+            logging.error(f"Failed to send video: {e}")
+    return await bot.send_message(chat_id=chat_id, text=caption_text)
+
+async def deliver(bot, chat_id: int, caption_text: str, meme_video=None):
+    """Sends one notification. Returns the sent message (True if none was
+    returned), False if the chat is permanently unreachable, or None if this
+    one send failed (flood control, network, a bad row) and should be retried
+    next cycle."""
+    try:
+        message = await send_meme(bot, chat_id, meme_video, caption_text)
+    except Forbidden as e:
+        logging.warning(f"Chat {chat_id} unreachable: {e}")
+        return False
+    except BadRequest as e:
+        if "chat not found" in str(e).lower():
+            logging.warning(f"Chat {chat_id} unreachable: {e}")
+            return False
+        logging.error(f"Failed to send to chat {chat_id}: {e}")
+        return None
+    except TelegramError as e:
+        logging.error(f"Failed to send to chat {chat_id}: {e}")
+        return None
+    return message or True
+
+def state_key(source: dict, Wochentag: str) -> str:
+    """State section of a day; the default source keeps the plain day names."""
+    if source["name"] == DEFAULT_SOURCE:
+        return Wochentag
+    return f"{source['name']}-{Wochentag}"
+
+# One download pool per source, sized by its max_concurrency. Separate from
+# the default executor (meme renders), so neither busy renders nor a slow
+# host can hold up another source's downloads.
+_fetch_executors = {}
+
+def _fetch_executor(source: dict) -> ThreadPoolExecutor:
+    if source["name"] not in _fetch_executors:
+        _fetch_executors[source["name"]] = ThreadPoolExecutor(
+            max_workers=source["max_concurrency"], thread_name_prefix=f"fetch-{source['name']}"
+        )
+    return _fetch_executors[source["name"]]
+
+async def fetch_plan(source: dict, Wochentag: str):
+    """Downloads one day's plan of a source. Returns (Wochentag, html or None)."""
+    import requests
+
+    url = source["url"].format(day=Wochentag)
+    try:
+        response = await asyncio.get_running_loop().run_in_executor(
+            _fetch_executor(source),
+            functools.partial(requests.get, url, auth=(source["user"], source["password"]), timeout=source["timeout"])
+        )
+        response.raise_for_status()
+    except Exception as e:
+        logging.error(f"Fehler beim Abruf von {Wochentag} ({source['name']}): {e}")
+        return Wochentag, None
+    return Wochentag, response.content
+
+def collect_day(source: dict, Wochentag: str, html_content: bytes, state: dict,
+                user_data_raw: dict, unreachable: set):
+    """Parses one day's plan and returns (outstanding deliveries, state changed).
+    Deliveries are None if the page carries no date and was skipped."""
+    from bs4 import BeautifulSoup
+
     state_changed = False
+    deliveries = []  # (chat_id_int, state key, msg_hash, caption_text, meme_text)
+    key = state_key(source, Wochentag)
     
-    # Load current user subscriptions dynamically
-    user_data_raw = storage.load_data()
+    if key not in state:
+        state[key] = {"html_hash": "", "sent_messages": {}}
 
-    for Wochentag in Wochentage:
-        url = f"https://dksdd.de/vtp/{Wochentag}.html"
+    soup = BeautifulSoup(html_content, "html.parser")
+    
+    # Collect Oberstufe courses from this day's plan
+    courses_key = state_key(source, "discovered_courses")
+    discovered_courses = set(state.get(courses_key, []))
+    for tr in soup.find_all("tr"):
+        tds = tr.find_all("td")
+        if tds:
+            val = tds[0].text.strip()
+            if val.startswith("JG11/") or val.startswith("JG12/"):
+                parts = [p.strip() for p in val.split('/')]
+                if len(parts) > 1 and parts[1]:
+                    discovered_courses.add(parts[1])
+    discovered_courses = sorted(list(discovered_courses))
+    if discovered_courses != state.get(courses_key, []):
+        state[courses_key] = discovered_courses
+        state_changed = True
+    
+    datum_span = soup.find('span', class_='vpfuerdatum')
+    if not datum_span:
+        return None, state_changed
         
+    Datum = datum_span.text.strip()
+    
+    last_date = state[key].get("last_date", "")
+    if last_date != Datum:
+        logging.info(f"Neues Datum für {Wochentag} ({source['name']}): {Datum}. Resette State.")
+        state[key]["sent_messages"] = {}
+        state[key]["last_date"] = Datum
+        state_changed = True
+
+    for chat_id, entry in user_data_raw.items():
+        if isinstance(entry, list):
+            Klassen = entry
+            version = 0
+        else:
+            Klassen = entry.get("classes", [])
+            version = entry.get("version", 0)
+
         try:
-            response = requests.get(url, auth=(USER_VPLAN, PASSWORD_VPLAN))
-            response.raise_for_status()
-        except Exception as e:
-            logging.error(f"Fehler beim Abruf von {Wochentag}: {e}")
+            chat_id_int = int(chat_id)
+        except ValueError:
             continue
 
-        html_content = response.content
-        current_hash = calculate_hash(html_content)
-        
-        if Wochentag not in state:
-            state[Wochentag] = {"html_hash": "", "sent_messages": {}}
+        # Entries of a renamed or removed source fall back to the default source
+        if get_source(storage.get_entry_source(entry, DEFAULT_SOURCE))["name"] != source["name"]:
+            continue
+        if not storage.is_chat_active(entry) or chat_id_int in unreachable:
+            continue
 
-        if state[Wochentag]["html_hash"] == current_hash and not any(isinstance(v, dict) and v.get('version', 0) > 0 for v in user_data_raw.values()):
-             pass
+        rows = soup.find_all("tr")
+        for Klasse in Klassen:
+            matching_rows = []
+            for tr in rows:
+                tds = tr.find_all("td")
+                if tds and len(tds) >= 6:
+                    if matches_class(Klasse, tds[0].text.strip()):
+                        matching_rows.append(tr)
 
-        soup = BeautifulSoup(html_content, "html.parser")
-        
-        # Collect Oberstufe courses from this day's plan
-        discovered_courses = set(state.get("discovered_courses", []))
-        for tr in soup.find_all("tr"):
-            tds = tr.find_all("td")
-            if tds:
-                val = tds[0].text.strip()
-                if val.startswith("JG11/") or val.startswith("JG12/"):
-                    parts = [p.strip() for p in val.split('/')]
-                    if len(parts) > 1 and parts[1]:
-                        discovered_courses.add(parts[1])
-        state["discovered_courses"] = sorted(list(discovered_courses))
+            for idx, tr_klasse in enumerate(matching_rows):
+                zellen_inhalte = [td.text.strip() for td in tr_klasse.find_all("td")]
+
+                stunde = zellen_inhalte[1]
+                fach = zellen_inhalte[2]
+                lehrer = zellen_inhalte[3]
+                raum = zellen_inhalte[4]
+                info = zellen_inhalte[5]
+
+                caption_text = (
+                    f"📅 {Wochentag} ({Datum})\n"
+                    f"Klasse: {Klasse}\n"
+                    f"Stunde: {stunde} | Fach: {fach}\n"
+                    f"Lehrer: {lehrer} | Raum: {raum}\n"
+                    f"Info: {info}"
+                )
+                
+                msg_identifier = f"{chat_id}_{Klasse}_{idx}_{caption_text}_v{version}"
+                msg_hash = calculate_hash(msg_identifier)
+                
+                if msg_hash in state[key]["sent_messages"]:
+                    continue
+
+                meme_text = classify_row(Wochentag, fach, info).meme_text
+                deliveries.append((chat_id_int, key, msg_hash, caption_text, meme_text))
+
+    return deliveries, state_changed
+
+async def deliver_all(context, deliveries: list, where: str, state: dict,
+                      unreachable: set, delivered: set, cycle_start: float) -> bool:
+    """Sends a batch of notifications. All memes start rendering at once, and
+    text messages and finished memes go out side by side, so the batch takes
+    about as long as its slowest render.
+
+    The shedding level is re-checked before each render start, every few
+    sends and while waiting for renders, so a batch degrades as soon as the
+    cycle runs long. Returns True if state changed."""
+    state_changed = False
+    level = backpressure.LEVEL_NORMAL
+    handled = 0  # deliveries sent or given up on
+    position = {delivery: i for i, delivery in enumerate(deliveries)}
+
+    def mark_sent(delivery):
+        nonlocal state_changed
+        delivered.add(delivery[0])
+        state[delivery[1]]["sent_messages"][delivery[2]] = True
         state_changed = True
-        
-        datum_span = soup.find('span', class_='vpfuerdatum')
-        if not datum_span:
-            continue
-            
-        Datum = datum_span.text.strip()
-        
-        last_date = state[Wochentag].get("last_date", "")
-        if last_date != Datum:
-            logging.info(f"Neues Datum für {Wochentag}: {Datum}. Resette State.")
-            state[Wochentag]["sent_messages"] = {}
-            state[Wochentag]["last_date"] = Datum
-            state_changed = True
 
-        for chat_id, entry in user_data_raw.items():
-            if isinstance(entry, list):
-                Klassen = entry
-                version = 0
+    meme_deliveries = {}
+    text_queue = []
+    for delivery in deliveries:
+        if delivery[4]:
+            meme_deliveries.setdefault(delivery[4], []).append(delivery)
+        else:
+            text_queue.append(delivery)
+
+    renders = {}  # meme_text -> render task
+    text_ready = asyncio.Event()
+    memes_done = False
+
+    def send_as_text(batch):
+        text_queue.extend(batch)
+        backpressure.count("memes_sent_as_text", len(batch))
+        text_ready.set()
+
+    def shed_meme(meme_text):
+        send_as_text(meme_deliveries.pop(meme_text))
+
+    def update_level():
+        """Re-checks the backlog and sheds renders that are still running."""
+        nonlocal level
+        # Within a cycle memes are reused; older ones only once shedding starts,
+        # so normally every meme gets the next template of the rotation
+        render_queue = sum(
+            1 for t in meme_deliveries
+            if (t not in renders or not renders[t].done()) and get_cached_meme(t, since=cycle_start) is None
+        )
+        new_level = backpressure.choose_level(
+            render_queue=render_queue,
+            send_queue=len(deliveries) - handled,
+            cycle_seconds=time.monotonic() - cycle_start,
+            where=where,
+            current=level
+        )
+        if new_level == level:
+            return
+        level = new_level
+        for meme_text, task in list(renders.items()):
+            if task.done():
+                continue  # send_memes applies the new level to finished memes
+            task.cancel()  # the render itself goes on and still fills the cache
+            if level == backpressure.LEVEL_CACHED_MEMES and get_cached_meme(meme_text) is not None:
+                renders[meme_text] = asyncio.ensure_future(render_meme(meme_text))
             else:
-                Klassen = entry.get("classes", [])
-                version = entry.get("version", 0)
+                del renders[meme_text]
+                shed_meme(meme_text)
 
-            try:
-                chat_id_int = int(chat_id)
-            except ValueError:
+    def after_send():
+        nonlocal handled
+        handled += 1
+        if handled % backpressure.RECHECK_EVERY_SENDS == 0:
+            update_level()
+
+    # Start one render per distinct meme text, all at once
+    for meme_text in list(meme_deliveries):
+        update_level()
+        if level >= backpressure.LEVEL_TEXT_ONLY or (
+                level == backpressure.LEVEL_CACHED_MEMES and get_cached_meme(meme_text) is None):
+            shed_meme(meme_text)
+            continue
+        logging.info(f"Generiere Meme für: {meme_text}")
+        cached_since = None if level >= backpressure.LEVEL_CACHED_MEMES else cycle_start
+        renders[meme_text] = asyncio.ensure_future(render_meme(meme_text, cached_since))
+
+    async def send_combined():
+        # Keep plan order so combined messages read top to bottom
+        by_chat = {}
+        for delivery in sorted(text_queue, key=position.get):
+            by_chat.setdefault(delivery[0], []).append(delivery)
+        text_queue.clear()
+        for chat_id_int, chat_deliveries in by_chat.items():
+            messages = combine_captions(chat_deliveries)
+            backpressure.count("messages_saved_by_combining", len(chat_deliveries) - len(messages))
+            for text, included in messages:
+                if chat_id_int in unreachable:
+                    break
+                sent = await deliver(context.bot, chat_id_int, text)
+                if sent is False:
+                    unreachable.add(chat_id_int)
+                if sent:
+                    for delivery in included:
+                        mark_sent(delivery)
+            for _ in chat_deliveries:
+                after_send()
+
+    async def send_texts():
+        while text_queue or not memes_done:
+            if not text_queue:
+                text_ready.clear()
+                await text_ready.wait()
+                continue
+            if level >= backpressure.LEVEL_COMBINED:
+                await send_combined()
                 continue
+            delivery = text_queue.pop(0)
+            if delivery[0] not in unreachable:
+                sent = await deliver(context.bot, delivery[0], delivery[3])
+                if sent is False:
+                    unreachable.add(delivery[0])
+                if sent:
+                    mark_sent(delivery)
+            after_send()
+
+    async def send_meme_batch(meme_text, meme_video):
+        batch = meme_deliveries[meme_text]
+        for i, delivery in enumerate(batch):
+            if level >= backpressure.LEVEL_TEXT_ONLY:
+                send_as_text(batch[i:])
+                return
+            if delivery[0] not in unreachable:
+                sent = await deliver(context.bot, delivery[0], delivery[3], meme_video)
+                if sent is False:
+                    unreachable.add(delivery[0])
+                if sent:
+                    mark_sent(delivery)
+                    # Upload once, then let Telegram reuse the file for everyone else
+                    video = getattr(sent, "video", None)
+                    if video is not None:
+                        meme_video = video.file_id
+            after_send()
+
+    async def send_memes():
+        nonlocal memes_done
+        # Memes go out in the order their renders finish
+        processed = set()
+        try:
+            while True:
+                pending = [task for task in renders.values() if task not in processed]
+                if not pending:
+                    break
+                done, _ = await asyncio.wait(
+                    pending, timeout=backpressure.RECHECK_SECONDS, return_when=asyncio.FIRST_COMPLETED
+                )
+                update_level()
+                for task in done:
+                    processed.add(task)
+                    if not task.cancelled():
+                        await send_meme_batch(*task.result())
+        finally:
+            memes_done = True
+            text_ready.set()
+
+    # If one sender fails, the other must not go on sending after the
+    # caller has already saved the state of this cycle
+    senders = [asyncio.ensure_future(send_texts()), asyncio.ensure_future(send_memes())]
+    try:
+        await asyncio.gather(*senders)
+    finally:
+        for task in senders + list(renders.values()):
+            task.cancel()
+
+    return state_changed
 
-            rows = soup.find_all("tr")
-            for Klasse in Klassen:
-                matching_rows = []
-                for tr in rows:
-                    tds = tr.find_all("td")
-                    if tds and len(tds) >= 6:
-                        if matches_class(Klasse, tds[0].text.strip()):
-                            matching_rows.append(tr)
-
-                for idx, tr_klasse in enumerate(matching_rows):
-                    zellen_inhalte = [td.text.strip() for td in tr_klasse.find_all("td")]
-
-                    stunde = zellen_inhalte[1]
-                    fach = zellen_inhalte[2]
-                    lehrer = zellen_inhalte[3]
-                    raum = zellen_inhalte[4]
-                    info = zellen_inhalte[5]
-
-                    caption_text = (
-                        f"📅 {Wochentag} ({Datum})\n"
-                        f"Klasse: {Klasse}\n"
-                        f"Stunde: {stunde} | Fach: {fach}\n"
-                        f"Lehrer: {lehrer} | Raum: {raum}\n"
-                        f"Info: {info}"
-                    )
-                    
-                    msg_identifier = f"{chat_id}_{Klasse}_{idx}_{caption_text}_v{version}"
-                    msg_hash = calculate_hash(msg_identifier)
-                    
-                    if msg_hash in state[Wochentag]["sent_messages"]:
-                        continue
-                    
-                    # Decide: Meme or Text
-                    if info and (("fällt aus" in info.lower()) or "--" in fach):
-                        subject_mapping = {
-                            "PH": "Physik", "MA": "Mathe", "KU": "Kunst", "EN": "Englisch",
-                            "FR": "Französisch", "MU": "Musik", "SPO": "Sport", "ETH": "Ethik",
-                            "DE": "Deutsch", "GE": "Geschichte", "GEO": "Geo",
-                            "CH": "Chemie", "INF": "Info", "GRW": "GRW", "BIO": "Bio",
-                            "FÖ": "Förderung"
-                        }
-                        
-                        # Improved Subject Detection
-                        detected_subject = None
-
-                        # 1. Try to find a known subject in the 'Info' string specifically if it's a cancellation
-                        if "fällt aus" in info.lower():
-                            # Find all uppercase words of length 2-3 (e.g. BIO, MA, DE)
-                            words = re.findall(r'\b[A-Z]{2,3}\b', info)
-                            for word in words:
-                                if word in subject_mapping:
-                                    detected_subject = subject_mapping[word]
-                                    break
-                        
-                        # 2. If not found in Info, use the 'Fach' column if it's valid (not ---)
-                        if not detected_subject and fach and "--" not in fach:
-                             match_subj = re.search(r'([a-zA-Z]+)', fach)
-                             if match_subj:
-                                 abbr = match_subj.group(1).upper()
-                                 detected_subject = subject_mapping.get(abbr, fach)
-
-                        # 3. Fallback: Parse first word of Info (for rows like "---" where info is "BIO fällt aus")
-                        if not detected_subject:
-                            raw_subject = info.split()[0]
-                            match_subj = re.search(r'([a-zA-Z]+)', raw_subject)
-                            if match_subj:
-                                abbr = match_subj.group(1).upper()
-                                detected_subject = subject_mapping.get(abbr, re.sub(r'\d+$', '', raw_subject))
-                            else:
-                                detected_subject = raw_subject
-
-                        # Determine Meme Text
-                        # Prioritize Cancellation if "fällt aus" is in info
-                        if "fällt aus" in info.lower():
-                             meme_text = f"am {Wochentag} kein {detected_subject}"
-                        elif "verlegt" in info.lower() or "verschoben" in info.lower():
-                             meme_text = f"Am {Wochentag} {detected_subject} verschoben"
-                        else:
-                             meme_text = f"am {Wochentag} kein {detected_subject}"
-                        
-                        logging.info(f"Generiere Meme für: {meme_text}")
-                        
-                        meme_path = create_meme(get_next_template_id(), meme_text)
-                        
-                        if meme_path:
-                            try:
-                                with open(meme_path, 'rb') as video_file:
-                                    await context.bot.send_video(
-                                        chat_id=chat_id_int,
-                                        video=video_file,
-                                        caption=caption_text
-                                    )
-                                os.remove(meme_path)
-                            except Exception as e:
-                                logging.error(f"Failed to send video: {e}")
-                                await context.bot.send_message(chat_id=chat_id_int, text=caption_text)
-                        else:
-                            await context.bot.send_message(chat_id=chat_id_int, text=caption_text)
-                    else:
-                        await context.bot.send_message(chat_id=chat_id_int, text=caption_text)
-                    
-                    state[Wochentag]["sent_messages"][msg_hash] = True
-                    state_changed = True
-
-        if state[Wochentag]["html_hash"] != current_hash:
-            state[Wochentag]["html_hash"] = current_hash
+async def check_source(context, source: dict, state: dict, user_data_raw: dict,
+                       unreachable: set, delivered: set, cycle_start: float) -> bool:
+    """Fetches all days of a source concurrently, then delivers all of their
+    notifications in one batch so every meme of the week renders at once."""
+    fetches = [fetch_plan(source, Wochentag) for Wochentag in source["days"]]
+
+    state_changed = False
+    deliveries = []
+    new_hashes = {}
+    for finished in asyncio.as_completed(fetches):
+        Wochentag, html_content = await finished
+        if html_content is None:
+            continue
+        day_deliveries, changed = collect_day(source, Wochentag, html_content, state, user_data_raw, unreachable)
+        state_changed = state_changed or changed
+        if day_deliveries is None:
+            continue
+        deliveries.extend(day_deliveries)
+        new_hashes[state_key(source, Wochentag)] = calculate_hash(html_content)
+
+    if deliveries and await deliver_all(context, deliveries, source["name"], state,
+                                        unreachable, delivered, cycle_start):
+        state_changed = True
+
+    for key, current_hash in new_hashes.items():
+        if state[key]["html_hash"] != current_hash:
+            state[key]["html_hash"] = current_hash
+            state_changed = True
+    return state_changed
+
+_check_lock = asyncio.Lock()
+
+async def check_updates(context: ContextTypes.DEFAULT_TYPE):
+    """Periodic job to check for updates on the school website."""
+    # With concurrent updates /aktualisieren can overlap the scheduled job;
+    # a second run waits so no notification is sent twice.
+    async with _check_lock:
+        await _check_updates(context)
+
+async def _check_updates(context: ContextTypes.DEFAULT_TYPE):
+    logging.info("Checking for updates...")
+    cycle_start = time.monotonic()
+    state = load_state()
+    
+    # Load current user subscriptions dynamically
+    user_data_raw = storage.load_data()
+
+    # Chats that blocked the bot or no longer exist are skipped for the rest
+    # of the cycle and reported to storage at the end
+    unreachable = set()
+    delivered = set()
+
+    # Sources run side by side; a slow or failing host only affects its own subscribers
+    results = await asyncio.gather(
+        *(check_source(context, source, state, user_data_raw, unreachable, delivered, cycle_start)
+          for source in SOURCES),
+        return_exceptions=True
+    )
+    state_changed = False
+    for source, result in zip(SOURCES, results):
+        if isinstance(result, Exception):
+            logging.error(f"Fehler bei Quelle {source['name']}: {result}")
+            # Messages sent before the failure are already marked in state;
+            # save_state only writes the sections that really changed
+            state_changed = True
+        elif result:
             state_changed = True
 
     if state_changed:
         save_state(state)
 
-async def manual_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Triggers a manual update check."""
-    await context.bot.send_message(
-        chat_id=update.effective_chat.id,
-        text="Prüfe auf Updates..."
-    )
-    await check_updates(context)
-    await context.bot.send_message(
-        chat_id=update.effective_chat.id,
-        text="Prüfung abgeschlossen."
+    pruned = storage.update_delivery_status(unreachable, delivered, PRUNE_AFTER_FAILURES)
+    if pruned:
+        logging.warning(f"Pruned {len(pruned)} unreachable chat(s): {', '.join(pruned)}")
+        for admin_id in ADMIN_CHAT_IDS:
+            try:
+                await context.bot.send_message(
+                    chat_id=admin_id,
+                    text=f"{len(pruned)} nicht erreichbare(r) Chat(s) deaktiviert."
+                )
+            except Exception as e:
+                logging.error(f"Failed to notify admin {admin_id}: {e}")
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin report on active and pruned chats."""
+    chat_id = update.effective_chat.id
+    if chat_id not in ADMIN_CHAT_IDS:
+        return
+
+    counts = storage.get_chat_counts()
+    text = (
+        f"Aktive Chats: {counts['active']}\n"
+        f"Deaktiviert (nicht erreichbar): {counts['inactive']}"
     )
+    if backpressure.stats:
+        shed = "\n".join(f"- {name}: {n}" for name, n in sorted(backpressure.stats.items()))
+        text += f"\n\nLoad Shedding seit Start:\n{shed}"
+    await context.bot.send_message(chat_id=chat_id, text=text)
 
-def main():
-    token = os.getenv("TELEGRAM_BOT_TOKEN")
-    if not token or token.startswith("123456"):
-        print("Error: TELEGRAM_BOT_TOKEN is not set properly.")
+_manual_check = None
+
+async def manual_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Triggers a manual update check in the background."""
+    global _manual_check
+    chat_id = update.effective_chat.id
+
+    # Presses while a check is running or pending are merged into that check
+    if _check_lock.locked() or (_manual_check is not None and not _manual_check.done()):
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text="Eine Prüfung läuft bereits, du wirst wie alle anderen benachrichtigt."
+        )
         return
 
-    application = ApplicationBuilder().token(token).build()
+    await context.bot.send_message(chat_id=chat_id, text="Prüfe auf Updates...")
+    # Run outside the handler so it doesn't hold an update slot for a whole cycle
+    _manual_check = context.application.create_task(_run_manual_update(context, chat_id))
+
+async def _run_manual_update(context: ContextTypes.DEFAULT_TYPE, chat_id: int):
+    await check_updates(context)
+    await context.bot.send_message(chat_id=chat_id, text="Prüfung abgeschlossen.")
+
+def build_application(token: str = None, bot=None):
+    """Builds the Application and registers all handlers and jobs.
+
+    A ready-made ``bot`` (e.g. the fake bot of loadtest.py) replaces the token.
+    """
+    builder = ApplicationBuilder()
+    builder = builder.bot(bot) if bot is not None else builder.token(token)
+    builder = builder.concurrent_updates(PerChatUpdateProcessor(CONCURRENT_UPDATES))
+    application = builder.build()
     
     # Commands
     application.add_handler(CommandHandler('start', start))
     application.add_handler(CommandHandler('stufe', stufe_command))
     application.add_handler(CommandHandler('hinzufuegen', add))
+    application.add_handler(CommandHandler('quelle', source_command))
     application.add_handler(CommandHandler('entfernen', remove))
     application.add_handler(CommandHandler('klassen', classes))
     application.add_handler(CommandHandler('aktualisieren', manual_update))
     application.add_handler(CommandHandler('zuruecksetzen', reset_data))
+    application.add_handler(CommandHandler('statistik', stats))
     
     # Callback query and message handlers
     application.add_handler(CallbackQueryHandler(button_click))
@@ -682,7 +1121,42 @@ def main():
     # Scraping Job
     job_queue = application.job_queue
     job_queue.run_repeating(check_updates, interval=3600, first=10)
-    
+
+    return application
+
+async def _log_ready(application):
+    """post_init hook: logs the time until initialize() (incl. getMe) is done."""
+    logging.info(f"Ready to poll after {time.perf_counter() - _STARTUP_T0:.3f}s")
+
+def main():
+    # With --startup-check the bot is built but not started; the exit code
+    # tells whether startup stayed within STARTUP_BUDGET seconds. The check
+    # covers module imports and handler registration, measured from the first
+    # line of bot.py: interpreter start-up and application.initialize() (a
+    # network call to Telegram) are not part of it. A real run logs the time
+    # until initialize() has finished.
+    startup_check = "--startup-check" in sys.argv[1:]
+
+    token = os.getenv("TELEGRAM_BOT_TOKEN")
+    if not startup_check and (not token or token.startswith("123456")):
+        print("Error: TELEGRAM_BOT_TOKEN is not set properly.")
+        return
+
+    application = build_application(token or "0:startup-check")
+
+    startup_time = time.perf_counter() - _STARTUP_T0
+    if startup_time > STARTUP_BUDGET:
+        logging.warning(f"Imports and handlers took {startup_time:.3f}s (budget {STARTUP_BUDGET:.3f}s)")
+    else:
+        logging.info(f"Imports and handlers took {startup_time:.3f}s (budget {STARTUP_BUDGET:.3f}s)")
+
+    if startup_check:
+        sys.exit(0 if startup_time <= STARTUP_BUDGET else 1)
+
+    # moviepy, bs4 and requests load in the background while polling starts
+    threading.Thread(target=_warm_up_imports, name="warm-up", daemon=True).start()
+
+    application.post_init = _log_ready
     print("Bot is running...")
     application.run_polling()
 
@@ -1,3 +1,4 @@
+import json
 import os
 from pathlib import Path
 from dotenv import load_dotenv
@@ -12,8 +13,93 @@ PASSWORD_VPLAN = os.getenv("PASSWORD_VPLAN")
 
 BASE_DIR = Path(__file__).resolve().parent
 TEMPLATE_DIR = BASE_DIR / "templates"
-OUTPUT_DIR = BASE_DIR / "output"
+# Memes werden im RAM (tmpfs) gerendert, falls verfügbar
+RENDER_DIR = os.getenv("RENDER_DIR") or ("/dev/shm" if os.path.isdir("/dev/shm") else None)
 COUNTER_FILE = BASE_DIR / "template_counter.txt"
-STATE_FILE = BASE_DIR / "state.json"
+STATE_FILE = BASE_DIR / "state.json"  # Altes Format, wird nach state/ migriert
+STATE_DIR = BASE_DIR / "state"
+RULES_FILE = BASE_DIR / "row_rules.json"
+ROW_CORPUS_FILE = BASE_DIR / "row_corpus.json"
+
+Wochentage = ["Montag", "Dienstag", "Mittwoch", "Donnerstag", "Freitag"]
+
+# --- PLAN-QUELLEN ---
+# Ohne sources.json gibt es nur die Standardquelle (dksdd.de mit USER_VPLAN/
+# PASSWORD_VPLAN). In sources.json kann jede Quelle eigene URL ({day} wird durch
+# den Wochentag ersetzt), Zugangsdaten, Tage und Parallelität haben. Passwörter
+# besser per "password_env" aus der Umgebung lesen. "courses_file" ist die
+# Kursliste der Quelle (wie faecher.txt).
+SOURCES_FILE = BASE_DIR / "sources.json"
+DEFAULT_SOURCE = "dksdd"
+
+def _load_sources():
+    if not SOURCES_FILE.exists():
+        raw_sources = [{
+            "name": DEFAULT_SOURCE,
+            "url": "https://dksdd.de/vtp/{day}.html",
+            "user": USER_VPLAN,
+            "password": PASSWORD_VPLAN,
+            "courses_file": "faecher.txt",
+        }]
+    else:
+        with open(SOURCES_FILE, "r", encoding="utf-8") as f:
+            raw_sources = json.load(f)
+
+    sources = []
+    for raw in raw_sources:
+        password = raw.get("password")
+        if raw.get("password_env"):
+            password = os.getenv(raw["password_env"])
+        sources.append({
+            "name": raw["name"],
+            "url": raw["url"],
+            "user": raw.get("user"),
+            "password": password,
+            "days": raw.get("days", Wochentage),
+            "max_concurrency": raw.get("max_concurrency", 5),
+            "timeout": raw.get("timeout", 30),
+            # Kursliste für das Oberstufen-Menü, sonst die im Plan gefundenen Kurse
+            "courses_file": BASE_DIR / raw["courses_file"] if raw.get("courses_file") else None,
+        })
+
+    # Nutzer ohne (gültige) Quelle landen bei der Standardquelle, sie muss es also geben
+    if not any(source["name"] == DEFAULT_SOURCE for source in sources):
+        raise ValueError(f"{SOURCES_FILE}: Standardquelle '{DEFAULT_SOURCE}' fehlt")
+    return sources
+
+SOURCES = _load_sources()
+
+
+# Chat-IDs, die Admin-Befehle (/statistik) nutzen und Berichte erhalten
+ADMIN_CHAT_IDS = {int(x) for x in os.getenv("ADMIN_CHAT_IDS", "").split(",") if x.strip()}
+# Nach so vielen Zyklen mit dauerhaftem Zustellfehler (blockiert, Chat gelöscht)
+# wird ein Chat deaktiviert, bis er wieder /start sendet
+PRUNE_AFTER_FAILURES = int(os.getenv("PRUNE_AFTER_FAILURES", "3"))
+
+# Wie viele Updates (verschiedener Chats) gleichzeitig bearbeitet werden;
+# Updates desselben Chats laufen immer nacheinander (wartende belegen dabei einen Platz)
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
+
+# --- LOAD SHEDDING ---
+# Schwellen (Stufe 1, 2, 3) für Render-Warteschlange, Sende-Warteschlange und
+# Zyklusdauer in Sekunden. Stufe 1: nur gecachte Memes, Stufe 2: nur Text,
+# Stufe 3: alle Zeilen eines Chats in einer Nachricht.
+def _thresholds(name, default):
+    return tuple(float(x) for x in os.getenv(name, default).split(","))
+
+SHED_RENDER_QUEUE = _thresholds("SHED_RENDER_QUEUE", "8,32,128")
+SHED_SEND_QUEUE = _thresholds("SHED_SEND_QUEUE", "200,500,1000")
+SHED_CYCLE_SECONDS = _thresholds("SHED_CYCLE_SECONDS", "120,300,600")
+# Maximale Renderzeit pro Meme, danach wird nur der Text gesendet
+RENDER_TIMEOUT = float(os.getenv("RENDER_TIMEOUT", "120"))
+# Gleichzeitige Renders (eigener Thread-Pool, getrennt von Downloads und Standard-Executor)
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "2"))
+# Fertige Memes, die im RAM für gleiche Texte wiederverwendet werden
+MEME_CACHE_SIZE = int(os.getenv("MEME_CACHE_SIZE", "32"))
+
+# Maximale Zeit in Sekunden für Imports und Handler-Registrierung (python bot.py
+# --startup-check), ohne Interpreter-Start und ohne den ersten Telegram-Aufruf.
+# Gemessen wurden ca. 0,3–0,5 s, der Standard lässt Luft für langsamere Hardware.
+STARTUP_BUDGET = float(os.getenv("STARTUP_BUDGET", "0.8"))
 
 # user_Klassen moved to data.json managed by storage.py
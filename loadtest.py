@@ -0,0 +1,188 @@
+"""Load test for the interactive handlers.
+
+Drives the handlers registered by bot.build_application() with synthetic
+updates against a fake Bot (no network) and a pre-populated, temporary
+data.json, then reports p50/p95/p99 latency per handler and throughput.
+
+    python loadtest.py --users 500 --concurrency 100 --api-latency 20
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import tempfile
+import time
+
+from telegram import Bot, Update, User
+
+import bot
+import storage
+
+class FakeBot(Bot):
+    """Bot whose API calls only sleep for a simulated latency and are counted."""
+
+    def __init__(self, api_latency: float = 0.0):
+        super().__init__("123456:LOADTEST")
+        with self._unfrozen():
+            self.api_latency = api_latency
+            self.stats = {"calls": 0}
+
+    async def get_me(self, *args, **kwargs):
+        self._bot_user = User(id=123456, first_name="LoadTest", is_bot=True, username="loadtest_bot")
+        return self._bot_user
+
+    async def _fake_call(self):
+        self.stats["calls"] += 1
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+        return True
+
+    async def send_message(self, *args, **kwargs):
+        return await self._fake_call()
+
+    async def edit_message_text(self, *args, **kwargs):
+        return await self._fake_call()
+
+    async def answer_callback_query(self, *args, **kwargs):
+        return await self._fake_call()
+
+    async def send_video(self, *args, **kwargs):
+        return await self._fake_call()
+
+def populate_storage(users: int, courses: list, rng: random.Random) -> dict:
+    """Writes a data.json with `users` students and returns it."""
+    data = {}
+    for i in range(users):
+        chat_id = str(100000 + i)
+        if rng.random() < 0.5:
+            data[chat_id] = {"classes": [f"{rng.randint(5, 10)}{rng.choice('abcde')}"], "version": 0, "stufe": "Mittelstufe"}
+        else:
+            data[chat_id] = {"classes": rng.sample(courses, min(len(courses), 8)), "version": 0, "stufe": "Oberstufe"}
+    storage.save_data(data)
+    return data
+
+def _chat(chat_id: int) -> dict:
+    return {"id": chat_id, "type": "private", "first_name": "Test"}
+
+def _user(chat_id: int) -> dict:
+    return {"id": chat_id, "is_bot": False, "first_name": "Test"}
+
+def command_update(update_id: int, chat_id: int, command: str) -> dict:
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()), "chat": _chat(chat_id), "from": _user(chat_id),
+        "text": command, "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}],
+    }}
+
+def text_update(update_id: int, chat_id: int, text: str) -> dict:
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()), "chat": _chat(chat_id), "from": _user(chat_id),
+        "text": text,
+    }}
+
+def callback_update(update_id: int, chat_id: int, data: str) -> dict:
+    return {"update_id": update_id, "callback_query": {
+        "id": str(update_id), "from": _user(chat_id), "chat_instance": str(chat_id), "data": data,
+        "message": {"message_id": 1, "date": int(time.time()), "chat": _chat(chat_id), "text": "Menü"},
+    }}
+
+def user_script(chat_id: int, entry: dict, courses: list, rng: random.Random) -> list:
+    """The (label, payload builder) steps of one student opening the course menu at term start."""
+    steps = [("/klassen", lambda i: command_update(i, chat_id, "/klassen"))]
+    if entry["stufe"] == "Mittelstufe":
+        grade = rng.randint(5, 10)
+        class_name = f"{grade}{rng.choice('abcde')}"
+        steps += [
+            ("menu_mittel_grades", lambda i: callback_update(i, chat_id, "menu_mittel_grades")),
+            ("menu_mittel_letters", lambda i: callback_update(i, chat_id, f"menu_mittel_letters:{grade}")),
+            ("set_class", lambda i: callback_update(i, chat_id, f"set_class:{class_name}")),
+        ]
+    else:
+        jg = rng.choice(["11", "12"])
+        jg_courses = [c for c in courses if c.startswith(jg)] or courses
+        steps.append(("menu_ober_jg", lambda i: callback_update(i, chat_id, f"menu_ober_jg{jg}")))
+        for course in rng.sample(jg_courses, min(3, len(jg_courses))):
+            steps.append(("toggle_course", lambda i, c=course: callback_update(i, chat_id, f"toggle_course:{c}:{jg}")))
+        steps += [
+            ("enter_course_manual", lambda i: callback_update(i, chat_id, "enter_course_manual")),
+            ("handle_text", lambda i: text_update(i, chat_id, f"{jg}xx{rng.randint(1, 9)}")),
+            ("done", lambda i: callback_update(i, chat_id, "done")),
+        ]
+    return steps
+
+def percentile(sorted_values: list, p: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(p / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+async def run(users: int, concurrency: int, api_latency: float, seed: int) -> dict:
+    rng = random.Random(seed)
+    courses = bot.get_available_courses()
+    data = populate_storage(users, courses, rng)
+
+    fake_bot = FakeBot(api_latency)
+    application = bot.build_application(bot=fake_bot)
+    errors = []
+
+    async def on_error(update, context):
+        errors.append(context.error)
+
+    application.add_error_handler(on_error)
+    await application.initialize()
+
+    latencies = {}
+    update_ids = iter(range(1, 10**9))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def simulate(chat_id: str, entry: dict):
+        # Each student's updates run in order, different students in parallel
+        async with semaphore:
+            for label, build in user_script(int(chat_id), entry, courses, rng):
+                update = Update.de_json(build(next(update_ids)), application.bot)
+                t0 = time.perf_counter()
+                # Through the update processor, like the real polling loop
+                await application.update_processor.process_update(update, application.process_update(update))
+                latencies.setdefault(label, []).append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(simulate(chat_id, entry) for chat_id, entry in data.items()))
+    elapsed = time.perf_counter() - t0
+
+    await application.shutdown()
+    return {"latencies": latencies, "elapsed": elapsed, "api_calls": fake_bot.stats["calls"], "errors": errors}
+
+def report(result: dict):
+    latencies = result["latencies"]
+    total = sum(len(v) for v in latencies.values())
+    print(f"{'Handler':<22}{'n':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for label, values in sorted(latencies.items()):
+        values = sorted(values)
+        print(f"{label:<22}{len(values):>7}"
+              f"{percentile(values, 50) * 1000:>10.2f}"
+              f"{percentile(values, 95) * 1000:>10.2f}"
+              f"{percentile(values, 99) * 1000:>10.2f}")
+    print(f"\n{total} updates in {result['elapsed']:.2f}s "
+          f"({total / result['elapsed']:.1f} updates/s, {result['api_calls']} API calls)")
+    if result["errors"]:
+        print(f"{len(result['errors'])} handler errors, first: {result['errors'][0]!r}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=500, help="students in the generated data.json")
+    parser.add_argument("--concurrency", type=int, default=50, help="students active at the same time")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="simulated Telegram API latency in ms")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    # Never touch the real data.json
+    with tempfile.TemporaryDirectory(prefix="loadtest_") as tmp_dir:
+        storage.DATA_FILE = os.path.join(tmp_dir, "data.json")
+        result = asyncio.run(run(args.users, args.concurrency, args.api_latency / 1000, args.seed))
+    report(result)
+
+if __name__ == "__main__":
+    main()
@@ -1,62 +1,171 @@
+import atexit
 import os
-import PIL.Image
-from moviepy.editor import VideoFileClip, TextClip, CompositeVideoClip
-from config import TEMPLATE_DIR, OUTPUT_DIR, COUNTER_FILE
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from config import TEMPLATE_DIR, RENDER_DIR, COUNTER_FILE, MEME_CACHE_SIZE
 
-# --- MOVIEPY & PILLOW FIX ---
-if not hasattr(PIL.Image, 'ANTIALIAS'):
-    PIL.Image.ANTIALIAS = PIL.Image.LANCZOS
+# moviepy (inkl. imageio, numpy, ffmpeg- und ImageMagick-Suche) wird erst beim
+# ersten Meme oder per warm_up() im Hintergrund geladen, nicht beim Bot-Start.
+_moviepy_editor = None
+_moviepy_lock = threading.Lock()
 
-def get_next_template_id():
-    """Liest den nächsten Template-Counter, inkrementiert ihn und speichert ihn ab."""
-    current_id = 1
-    
-    # 1. Aktuellen Stand lesen
+def _load_moviepy():
+    """Importiert moviepy beim ersten Gebrauch und gibt moviepy.editor zurück."""
+    global _moviepy_editor
+    with _moviepy_lock:
+        if _moviepy_editor is None:
+            import PIL.Image
+
+            # --- MOVIEPY & PILLOW FIX ---
+            if not hasattr(PIL.Image, 'ANTIALIAS'):
+                PIL.Image.ANTIALIAS = PIL.Image.LANCZOS
+
+            import moviepy.editor
+            _moviepy_editor = moviepy.editor
+    return _moviepy_editor
+
+def warm_up():
+    """Lädt moviepy vorab, damit das erste Meme nicht auf den Import wartet."""
+    try:
+        _load_moviepy()
+    except Exception as e:
+        print(f"Fehler beim Vorladen von moviepy: {e}")
+
+# --- TEMPLATE-REGISTRY ---
+# Die Template-Liste wird einmal gescannt (und neu, sobald sich TEMPLATE_DIR
+# ändert) und im Speicher reihum vergeben. Der Stand landet nur alle
+# COUNTER_SAVE_INTERVAL Memes und beim Beenden in COUNTER_FILE.
+COUNTER_SAVE_INTERVAL = 10
+
+_template_lock = threading.Lock()
+_template_ids = []
+_template_dir_mtime = None
+_next_template_id = None
+_unsaved_ids = 0
+
+def _refresh_templates():
+    """Scannt TEMPLATE_DIR neu, falls sich das Verzeichnis geändert hat."""
+    global _template_ids, _template_dir_mtime
+    try:
+        mtime = TEMPLATE_DIR.stat().st_mtime_ns
+    except OSError:
+        mtime = None
+    if mtime == _template_dir_mtime and _template_ids:
+        return
+
+    _template_dir_mtime = mtime
+    if mtime is None:
+        _template_ids = []
+    else:
+        _template_ids = sorted(
+            int(p.stem) for p in TEMPLATE_DIR.glob("*.mp4") if p.stem.isdigit()
+        )
+    if not _template_ids:
+        print(f"❌ ACHTUNG: Keine Templates in {TEMPLATE_DIR} gefunden!")
+
+def _load_counter():
+    """Liest den gespeicherten nächsten Template-Counter (Standard: 1)."""
     if COUNTER_FILE.exists():
         try:
-            with open(COUNTER_FILE, "r") as f:
-                content = f.read().strip()
-                if content.isdigit():
-                    current_id = int(content)
+            content = COUNTER_FILE.read_text().strip()
+            if content.isdigit():
+                return int(content)
         except Exception as e:
             print(f"Fehler beim Lesen des Counters: {e}")
-            current_id = 1
-
-    # 2. Prüfen ob Template existiert
-    template_path = TEMPLATE_DIR / f"{current_id}.mp4"
-    if not template_path.exists():
-        print(f"ℹ️ Template {current_id} existiert nicht. Resette auf 1.")
-        current_id = 1
-        # Sicherheitshalber prüfen ob 1 existiert
-        if not (TEMPLATE_DIR / "1.mp4").exists():
-            print("❌ ACHTUNG: Template 1.mp4 fehlt auch! Das könnte Probleme geben.")
-
-    # 3. Nächsten Wert berechnen und speichern
-    next_id = current_id + 1
-    try:
-        with open(COUNTER_FILE, "w") as f:
-            f.write(str(next_id))
-    except Exception as e:
-        print(f"Fehler beim Speichern des Counters: {e}")
+    return 1
+
+def save_template_counter():
+    """Speichert den nächsten Template-Counter atomar in COUNTER_FILE."""
+    global _unsaved_ids
+    with _template_lock:
+        if _next_template_id is None or not _unsaved_ids:
+            return
+        tmp_file = COUNTER_FILE.with_name(COUNTER_FILE.name + ".tmp")
+        try:
+            tmp_file.write_text(str(_next_template_id))
+            os.replace(tmp_file, COUNTER_FILE)
+            _unsaved_ids = 0
+        except Exception as e:
+            print(f"Fehler beim Speichern des Counters: {e}")
 
+def get_next_template_id():
+    """Gibt reihum das nächste vorhandene Template zurück (threadsicher)."""
+    global _next_template_id, _unsaved_ids
+    with _template_lock:
+        _refresh_templates()
+        if _next_template_id is None:
+            _next_template_id = _load_counter()
+        if not _template_ids:
+            return 1
+
+        # Lücken in der Nummerierung überspringen, am Ende wieder vorne anfangen
+        current_id = next((i for i in _template_ids if i >= _next_template_id), _template_ids[0])
+        _next_template_id = current_id + 1
+        _unsaved_ids += 1
+        save_due = _unsaved_ids >= COUNTER_SAVE_INTERVAL
+
+    if save_due:
+        save_template_counter()
     return current_id
 
+atexit.register(save_template_counter)
+
+# --- MEME-CACHE ---
+# Fertige Memes nach Text mit Zeitpunkt (time.monotonic) des Renderns, damit
+# gleiche Texte im selben Zyklus nicht neu gerendert werden und unter Last
+# überhaupt noch Memes verschickt werden können. Ältere Memes nur unter Last
+# wiederverwenden, sonst bekäme ein Text jede Woche dasselbe Template.
+_meme_cache = OrderedDict()
+_meme_cache_lock = threading.Lock()
+
+def get_cached_meme(text: str, since: float = None):
+    """Gibt ein bereits gerendertes Meme für den Text zurück (oder None).
+    Mit since nur, wenn es nicht vor diesem Zeitpunkt gerendert wurde."""
+    with _meme_cache_lock:
+        cached = _meme_cache.get(text)
+        if cached is None or (since is not None and cached[1] < since):
+            return None
+        _meme_cache.move_to_end(text)
+        return cached[0]
+
+def cache_meme(text: str, video: bytes):
+    """Legt ein Meme im Cache ab und verdrängt das am längsten unbenutzte."""
+    with _meme_cache_lock:
+        _meme_cache[text] = (video, time.monotonic())
+        _meme_cache.move_to_end(text)
+        while len(_meme_cache) > MEME_CACHE_SIZE:
+            _meme_cache.popitem(last=False)
+
 def create_meme(video_id: int, text: str):
-    """Erstellt ein Meme und gibt den Dateipfad zurück"""
-    clean_text = "".join(c if c.isalnum() else "_" for c in text).strip("_")
-    while "__" in clean_text: clean_text = clean_text.replace("__", "_")
-    
+    """Erstellt ein Meme und gibt das fertige MP4 als bytes zurück.
+
+    Alle Zwischendateien (Text-PNG, Audiospur, Video) landen in einem eigenen
+    Temp-Verzeichnis unter RENDER_DIR (tmpfs), das danach sofort gelöscht wird.
+    Gleichzeitige Renders kommen sich dadurch nicht in die Quere.
+    """
     input_path = TEMPLATE_DIR / f"{video_id}.mp4"
-    output_file = OUTPUT_DIR / f"meme_{video_id}_{clean_text}.mp4"
 
     if not input_path.exists():
         print(f"❌ Template fehlt: {input_path}")
         return None
 
-    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    try:
+        with tempfile.TemporaryDirectory(prefix="meme_", dir=RENDER_DIR) as render_dir:
+            return _render(input_path, text, render_dir)
+    except Exception as e:
+        print(f"Fehler beim Erstellen des Memes: {e}")
+        return None
+
+def _render(input_path, text: str, render_dir: str) -> bytes:
+    editor = _load_moviepy()
+    VideoFileClip, TextClip, CompositeVideoClip = editor.VideoFileClip, editor.TextClip, editor.CompositeVideoClip
 
+    output_file = os.path.join(render_dir, "meme.mp4")
+    source = VideoFileClip(str(input_path))
     try:
-        video = VideoFileClip(str(input_path))
+        video = source
         
         # Auf Quadrat zuschneiden
         min_dim = min(video.w, video.h)
@@ -74,23 +183,26 @@ def create_meme(video_id: int, text: str):
             stroke_width=2,
             method='caption',
             size=(target_width * upscale_factor, None),
-            align='Center'
+            align='Center',
+            tempfilename=os.path.join(render_dir, "text.png"),
+            temptxt=os.path.join(render_dir, "text.txt")
         ).resize(1/upscale_factor).set_position('center').set_duration(video.duration)
 
         final_video = CompositeVideoClip([video, txt_clip])
         
         # Audio codec aac ist wichtig für Telegram
         final_video.write_videofile(
-            str(output_file),
+            output_file,
             fps=24,
             codec='libx264',
             audio_codec='aac',
+            temp_audiofile=os.path.join(render_dir, "audio.m4a"),
             preset='ultrafast',
             threads=4,
             logger=None # Unterdrückt den Moviepy Output im Log
         )
-        return output_file
-        
-    except Exception as e:
-        print(f"Fehler beim Erstellen des Memes: {e}")
-        return None
+    finally:
+        source.close()
+
+    with open(output_file, "rb") as f:
+        return f.read()
@@ -0,0 +1,96 @@
+import json
+import re
+from functools import lru_cache
+from typing import NamedTuple, Union
+
+from config import RULES_FILE, ROW_CORPUS_FILE
+
+KIND_TEXT = "text"
+KIND_CANCELLED = "cancelled"
+KIND_MOVED = "moved"
+
+class RowClass(NamedTuple):
+    """Result of classifying one plan row."""
+    kind: str
+    subject: Union[str, None]
+    meme_text: Union[str, None]
+
+def _keyword_pattern(keywords):
+    return re.compile("|".join(re.escape(k) for k in keywords), re.IGNORECASE)
+
+def load_rules(path=RULES_FILE):
+    """Loads the rule table and compiles its patterns."""
+    with open(path, "r", encoding="utf-8") as f:
+        rules = json.load(f)
+    return {
+        "subjects": rules["subjects"],
+        "cancel": _keyword_pattern(rules["cancel_keywords"]),
+        "move": _keyword_pattern(rules["move_keywords"]),
+        "no_subject_marker": rules["no_subject_marker"],
+        "fallback_subject": rules["fallback_subject"],
+        # Known abbreviations as whole words, longest first (GEO before GE)
+        "abbreviation": re.compile(
+            r'\b(' + "|".join(re.escape(k) for k in sorted(rules["subjects"], key=len, reverse=True)) + r')\b'
+        ),
+    }
+
+_RULES = load_rules()
+_LETTERS = re.compile(r'([^\W\d_]+)')
+_TRAILING_DIGITS = re.compile(r'\d+$')
+
+def _detect_subject(fach: str, info: str, cancelled: bool) -> Union[str, None]:
+    subjects = _RULES["subjects"]
+    marker = _RULES["no_subject_marker"]
+
+    # 1. Known abbreviation in 'Info' (e.g. "BIO fällt aus") if it's a cancellation
+    if cancelled:
+        match_abbr = _RULES["abbreviation"].search(info)
+        if match_abbr:
+            return subjects[match_abbr.group(1)]
+
+    # 2. The 'Fach' column if it's valid (not ---)
+    if fach and marker not in fach:
+        match_subj = _LETTERS.search(fach)
+        if match_subj:
+            return subjects.get(match_subj.group(1).upper(), fach)
+
+    # 3. Fallback: first word of 'Info' (for rows like "---"), unless 'Info'
+    # starts with the keyword itself ("verlegt auf ...") and names no subject
+    if _RULES["cancel"].match(info) or _RULES["move"].match(info):
+        return None
+    raw_subject = info.split()[0]
+    match_subj = _LETTERS.search(raw_subject)
+    if match_subj:
+        return subjects.get(match_subj.group(1).upper(), _TRAILING_DIGITS.sub('', raw_subject))
+    return raw_subject
+
+@lru_cache(maxsize=4096)
+def classify_row(Wochentag: str, fach: str, info: str) -> RowClass:
+    """Classifies a plan row by its 'Fach' and 'Info' cells (memoised)."""
+    cancelled = bool(info) and _RULES["cancel"].search(info) is not None
+    if not (cancelled or (info and _RULES["no_subject_marker"] in fach)):
+        return RowClass(KIND_TEXT, None, None)
+
+    subject = _detect_subject(fach, info, cancelled)
+    meme_subject = subject or _RULES["fallback_subject"]
+    if not cancelled and _RULES["move"].search(info):
+        return RowClass(KIND_MOVED, subject, f"Am {Wochentag} {meme_subject} verschoben")
+    return RowClass(KIND_CANCELLED, subject, f"am {Wochentag} kein {meme_subject}")
+
+def check_corpus(path=ROW_CORPUS_FILE) -> int:
+    """Classifies every row in the corpus and returns the number of mismatches."""
+    with open(path, "r", encoding="utf-8") as f:
+        corpus = json.load(f)
+
+    failures = 0
+    for case in corpus:
+        result = classify_row(case["wochentag"], case["fach"], case["info"])
+        expected = RowClass(case["kind"], case["subject"], case["meme_text"])
+        if result != expected:
+            failures += 1
+            print(f"❌ {case['fach']!r} / {case['info']!r}: {result} != {expected}")
+    print(f"{len(corpus) - failures}/{len(corpus)} Zeilen korrekt klassifiziert.")
+    return failures
+
+if __name__ == "__main__":
+    raise SystemExit(1 if check_corpus() else 0)
@@ -1,22 +1,85 @@
 import json
 import hashlib
-from config import STATE_FILE
+import os
+from config import STATE_FILE, STATE_DIR
+
+# Der State wird abschnittsweise (ein Top-Level-Schlüssel = eine Datei in
+# STATE_DIR) gespeichert. _persisted merkt sich den zuletzt gelesenen bzw.
+# geschriebenen Inhalt jedes Abschnitts, damit nur geänderte Abschnitte
+# geschrieben werden.
+_persisted = {}
+
+def _section_path(name):
+    return STATE_DIR / f"{name}.json"
+
+def _serialize(value):
+    return json.dumps(value, indent=4, ensure_ascii=False)
+
+def _atomic_write(path, text):
+    """Schreibt über eine Temp-Datei + fsync + os.replace, damit ein Absturz nie eine halbe Datei hinterlässt."""
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    try:
+        dir_fd = os.open(path.parent, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
 
 def load_state():
-    if STATE_FILE.exists():
+    state = {}
+    section_files = sorted(STATE_DIR.glob("*.json")) if STATE_DIR.exists() else []
+    if section_files:
+        for path in section_files:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    value = json.load(f)
+            except Exception as e:
+                print(f"Fehler beim Laden des State-Abschnitts {path.name}: {e}")
+                continue
+            state[path.stem] = value
+            _persisted[path.stem] = _serialize(value)
+    elif STATE_FILE.exists():
+        # Alte Einzeldatei: beim nächsten save_state in Abschnitte aufteilen
         try:
             with open(STATE_FILE, "r") as f:
                 return json.load(f)
         except Exception as e:
             print(f"Fehler beim Laden der State-Datei: {e}")
-    return {}
+    return state
 
 def save_state(state):
+    """Schreibt nur die Abschnitte, die sich seit dem letzten Laden/Speichern geändert haben."""
     try:
-        with open(STATE_FILE, "w") as f:
-            json.dump(state, f, indent=4)
+        STATE_DIR.mkdir(parents=True, exist_ok=True)
     except Exception as e:
         print(f"Fehler beim Speichern der State-Datei: {e}")
+        return
+
+    for name, value in state.items():
+        text = _serialize(value)
+        if _persisted.get(name) == text:
+            continue
+        try:
+            _atomic_write(_section_path(name), text)
+            _persisted[name] = text
+        except Exception as e:
+            print(f"Fehler beim Speichern des State-Abschnitts {name}: {e}")
+
+    for name in [n for n in _persisted if n not in state]:
+        try:
+            _section_path(name).unlink(missing_ok=True)
+            del _persisted[name]
+        except Exception as e:
+            print(f"Fehler beim Löschen des State-Abschnitts {name}: {e}")
 
 def calculate_hash(content):
     """Gibt den SHA256 Hash eines Strings oder Bytes zurück."""
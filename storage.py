@@ -1,15 +1,21 @@
 import json
 import os
+from contextlib import contextmanager
 from typing import Dict, List, Union
 
 
 DATA_FILE = "data.json"
 
+# All storage calls run on the event-loop thread, so a read-modify-write is
+# atomic as long as it does not await. Session bodies must therefore never
+# await; _open_session turns a violation into an error instead of a lost update.
+_open_session = False
+
 def load_data():
     """Loads the data from the JSON file."""
     if not os.path.exists(DATA_FILE):
         return {}
-    
+
     try:
         with open(DATA_FILE, 'r', encoding='utf-8') as f:
             return json.load(f)
@@ -17,10 +23,14 @@ def load_data():
         return {}
 
 def save_data(data):
-    """Saves the data to the JSON file."""
+    """Saves the data to the JSON file (temp file + os.replace, so readers never see a partial file)."""
+    tmp_file = DATA_FILE + ".tmp"
     try:
-        with open(DATA_FILE, 'w', encoding='utf-8') as f:
+        with open(tmp_file, 'w', encoding='utf-8') as f:
             json.dump(data, f, indent=4, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, DATA_FILE)
     except IOError as e:
         print(f"Error saving data: {e}")
 
@@ -28,81 +38,161 @@ def _get_user_entry(data, chat_id_str):
     """Helper to get user entry, migrating list to dict if necessary."""
     if chat_id_str not in data:
         return {"classes": [], "version": 0, "stufe": None}
-    
+
     entry = data[chat_id_str]
     if isinstance(entry, list):
         # Migration: convert list to dict
         return {"classes": entry, "version": 0, "stufe": None}
-    
+
     if "stufe" not in entry:
         entry["stufe"] = None
-        
+
     return entry
 
+@contextmanager
+def _exclusive():
+    """Marks a read-modify-write of data.json; raises if another one is still open."""
+    global _open_session
+    if _open_session:
+        raise RuntimeError("storage session opened while another is active (did a session body await?)")
+    _open_session = True
+    try:
+        yield
+    finally:
+        _open_session = False
+
+@contextmanager
+def session(chat_id: Union[str, int]):
+    """Unit of work on one user's entry: one read, at most one atomic write.
+
+    Yields the (mutable) entry dict. It is written back once when the block
+    exits normally and the entry actually changed; on an exception nothing is
+    written.
+    """
+    chat_id_str = str(chat_id)
+    with _exclusive():
+        data = load_data()
+        entry = _get_user_entry(data, chat_id_str)
+        # Compared after the migration in _get_user_entry, so only real changes are written
+        before = json.dumps(entry, sort_keys=True)
+        yield entry
+        if json.dumps(entry, sort_keys=True) != before:
+            data[chat_id_str] = entry
+            save_data(data)
+
+def get_student_entry(chat_id: Union[str, int]) -> Dict:
+    """Returns the whole entry (classes, stufe, version, ...) with a single read."""
+    data = load_data()
+    return _get_user_entry(data, str(chat_id))
+
 def get_student_stufe(chat_id: Union[str, int]) -> Union[str, None]:
     """Returns the level (stufe) of the student."""
-    data = load_data()
-    entry = _get_user_entry(data, str(chat_id))
-    return entry.get("stufe")
+    return get_student_entry(chat_id).get("stufe")
 
 def set_student_stufe(chat_id: Union[str, int], stufe: str, clear_classes: bool = False):
     """Sets the level (stufe) of the student and optionally clears classes."""
-    data = load_data()
-    chat_id_str = str(chat_id)
-    entry = _get_user_entry(data, chat_id_str)
-    entry["stufe"] = stufe
-    if clear_classes:
-        entry["classes"] = []
-    data[chat_id_str] = entry
-    save_data(data)
+    with session(chat_id) as entry:
+        entry["stufe"] = stufe
+        if clear_classes:
+            entry["classes"] = []
 
 def get_student_classes(chat_id: Union[str, int]) -> List[str]:
     """Returns the list of classes for a given chat_id."""
-    data = load_data()
-    entry = _get_user_entry(data, str(chat_id))
-    return entry["classes"]
+    return get_student_entry(chat_id)["classes"]
 
 def get_reset_version(chat_id: Union[str, int]) -> int:
     """Returns the reset version for a given chat_id."""
-    data = load_data()
-    entry = _get_user_entry(data, str(chat_id))
-    return entry.get("version", 0)
+    return get_student_entry(chat_id).get("version", 0)
 
 def increment_reset_version(chat_id: Union[str, int]) -> int:
     """Increments the reset version for a user."""
-    data = load_data()
-    chat_id_str = str(chat_id)
-    entry = _get_user_entry(data, chat_id_str)
-    
-    entry["version"] = entry.get("version", 0) + 1
-    data[chat_id_str] = entry
-    save_data(data)
+    with session(chat_id) as entry:
+        entry["version"] = entry.get("version", 0) + 1
     return entry["version"]
 
 def add_class(chat_id: Union[str, int], class_name: str) -> bool:
     """Adds a class to the student's list."""
-    data = load_data()
-    chat_id_str = str(chat_id)
-    entry = _get_user_entry(data, chat_id_str)
-    
-    if class_name in entry["classes"]:
-        return False
-    
-    entry["classes"].append(class_name)
-    data[chat_id_str] = entry
-    save_data(data)
+    with session(chat_id) as entry:
+        if class_name in entry["classes"]:
+            return False
+        entry["classes"].append(class_name)
     return True
 
 def remove_class(chat_id: Union[str, int], class_name: str) -> bool:
     """Removes a class from the student's list."""
-    data = load_data()
-    chat_id_str = str(chat_id)
-    entry = _get_user_entry(data, chat_id_str)
-    
-    if class_name in entry["classes"]:
+    with session(chat_id) as entry:
+        if class_name not in entry["classes"]:
+            return False
         entry["classes"].remove(class_name)
-        data[chat_id_str] = entry
-        save_data(data)
-        return True
-    
-    return False
+    return True
+
+def is_chat_active(entry) -> bool:
+    """Returns False for chats pruned as unreachable."""
+    return not isinstance(entry, dict) or entry.get("active", True)
+
+def reactivate_chat(chat_id: Union[str, int]) -> bool:
+    """Marks a pruned chat as active again. Returns True if it was inactive."""
+    with session(chat_id) as entry:
+        was_inactive = not entry.get("active", True)
+        if was_inactive or entry.get("failures"):
+            entry["active"] = True
+            entry["failures"] = 0
+    return was_inactive
+
+def update_delivery_status(failed, delivered, threshold: int) -> List[str]:
+    """Counts permanent delivery failures per chat and deactivates chats that
+    reach the threshold. Chats that received a message are reset.
+    Returns the chat_ids deactivated by this call."""
+    if not failed and not delivered:
+        return []
+
+    with _exclusive():
+        data = load_data()
+        changed = False
+        pruned = []
+
+        for chat_id in failed:
+            chat_id_str = str(chat_id)
+            if chat_id_str not in data:
+                continue
+            entry = _get_user_entry(data, chat_id_str)
+            entry["failures"] = entry.get("failures", 0) + 1
+            if entry["failures"] >= threshold and entry.get("active", True):
+                entry["active"] = False
+                pruned.append(chat_id_str)
+            data[chat_id_str] = entry
+            changed = True
+
+        for chat_id in delivered:
+            chat_id_str = str(chat_id)
+            entry = data.get(chat_id_str)
+            if isinstance(entry, dict) and entry.get("failures"):
+                entry["failures"] = 0
+                changed = True
+
+        if changed:
+            save_data(data)
+    return pruned
+
+def get_chat_counts() -> Dict[str, int]:
+    """Returns the number of active and pruned chats."""
+    data = load_data()
+    inactive = sum(1 for entry in data.values() if not is_chat_active(entry))
+    return {"active": len(data) - inactive, "inactive": inactive}
+
+def get_entry_source(entry, default: str) -> str:
+    """Returns the plan source a data.json entry subscribes to."""
+    if isinstance(entry, dict) and entry.get("source"):
+        return entry["source"]
+    return default
+
+def get_student_source(chat_id: Union[str, int], default: str) -> str:
+    """Returns the plan source of the student."""
+    data = load_data()
+    return get_entry_source(data.get(str(chat_id)), default)
+
+def set_student_source(chat_id: Union[str, int], source: str):
+    """Moves the student to another plan source and clears their classes."""
+    with session(chat_id) as entry:
+        entry["source"] = source
+        entry["classes"] = []